@@ -0,0 +1,25 @@
+#!/bin/sh
+# Whisper ASR container entrypoint
+#
+# With ASR_WORKERS > 1 every uvicorn worker loads its own copy of the model.
+# Setting ASR_CUDA_MPS=1 starts the CUDA Multi-Process Service so those
+# workers run their kernels concurrently on the GPU instead of time-slicing.
+# To avoid the per-worker VRAM cost entirely, keep ASR_WORKERS=1 and enable
+# ASR_BATCHER=1 so concurrency is handled in-process.
+
+set -e
+
+if [ "${ASR_CUDA_MPS:-0}" = "1" ] && [ "${ASR_WORKERS:-1}" -gt 1 ]; then
+    if command -v nvidia-cuda-mps-control >/dev/null 2>&1; then
+        export CUDA_MPS_PIPE_DIRECTORY="${CUDA_MPS_PIPE_DIRECTORY:-/tmp/nvidia-mps}"
+        export CUDA_MPS_LOG_DIRECTORY="${CUDA_MPS_LOG_DIRECTORY:-/tmp/nvidia-log}"
+        mkdir -p "$CUDA_MPS_PIPE_DIRECTORY" "$CUDA_MPS_LOG_DIRECTORY"
+        nvidia-cuda-mps-control -d
+        echo "CUDA MPS control daemon started"
+    else
+        echo "Warning: nvidia-cuda-mps-control not found, running workers without MPS"
+    fi
+fi
+
+# Hand off to the NGC base image entrypoint for its driver/CUDA-compat setup
+exec /opt/nvidia/nvidia_entrypoint.sh "$@"
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+prepare_model.py
+
+Convert the Whisper checkpoint to a pre-quantized CTranslate2 model at
+image build time so faster_whisper can load it directly on startup.
+"""
+
+import os
+import subprocess
+import sys
+
+ASR_MODEL = os.getenv("ASR_MODEL", "base")
+# Kept outside ASR_MODEL_PATH, which is mounted over by the whisper_cache volume
+ASR_CT2_MODEL_PATH = os.getenv("ASR_CT2_MODEL_PATH", "/opt/whisper-ct2")
+CT2_QUANTIZATION = "int8_float16"
+
+
+def converted_model_dir(model_name=ASR_MODEL, model_path=ASR_CT2_MODEL_PATH):
+    """Return the directory holding the pre-quantized CTranslate2 model."""
+    return os.path.join(model_path, f"{model_name}-ct2-{CT2_QUANTIZATION}")
+
+
+def main():
+    output_dir = converted_model_dir()
+    if os.path.isdir(output_dir):
+        print(f"Converted model already exists at {output_dir}. Skipping conversion.")
+        return
+
+    cmd = [
+        "ct2-transformers-converter",
+        "--model", f"openai/whisper-{ASR_MODEL}",
+        "--output_dir", output_dir,
+        "--quantization", CT2_QUANTIZATION,
+        "--copy_files", "tokenizer.json", "preprocessor_config.json"
+    ]
+    print("Running:", " ".join(cmd))
+    try:
+        subprocess.run(cmd, check=True)
+    except subprocess.CalledProcessError as e:
+        print(f"Error converting model '{ASR_MODEL}' (exit code {e.returncode})")
+        sys.exit(e.returncode)
+
+    print(f"Converted model written to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,35 @@ Whisper ASR Server - FastAPI-based Speech Recognition API
 Compatible with openai-whisper-asr-webservice API format
 """
 
+import asyncio
+import contextlib
+import dataclasses
+import functools
+import math
 import os
-import tempfile
 import logging
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Optional
+
+# Use physical cores only, split across uvicorn workers; hyperthreads and
+# oversubscription slow down GEMM-bound inference.
+# Must be set before numpy/torch/CTranslate2 initialize their thread pools.
+os.environ.setdefault(
+    "OMP_NUM_THREADS",
+    str(max(1, (os.cpu_count() or 2) // 2 // max(1, int(os.getenv("ASR_WORKERS", "1")))))
+)
+os.environ.setdefault("MKL_NUM_THREADS", os.environ["OMP_NUM_THREADS"])
+
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
-import torch
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+import numpy as np
+import orjson
+import soundfile as sf
+
+# Imported on first use via _torch(); the faster_whisper engine never needs it
+torch = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,11 +39,76 @@ logger = logging.getLogger(__name__)
 
 # Environment configuration
 ASR_MODEL = os.getenv("ASR_MODEL", "base")
-ASR_ENGINE = os.getenv("ASR_ENGINE", "openai_whisper")
+ASR_ENGINE = os.getenv("ASR_ENGINE", "faster_whisper")
 ASR_MODEL_PATH = os.getenv("ASR_MODEL_PATH", "/data/whisper")
+# CTranslate2 compute type: auto, default, int8, int8_float16, float16, bfloat16, int8_bfloat16
+# Applied at load time, so it also overrides the int8_float16 weights of a model
+# pre-converted by prepare_model.py. "auto" picks the fastest type for the device;
+# "default" keeps the type the model was converted with.
+ASR_QUANTIZATION = os.getenv("ASR_QUANTIZATION", "auto")
+ASR_NUM_WORKERS = int(os.getenv("ASR_NUM_WORKERS", "1"))
+ASR_CPU_THREADS = int(os.getenv("ASR_CPU_THREADS", os.environ["OMP_NUM_THREADS"]))
+# Greedy decoding by default; set ASR_BEAM_SIZE=5 for maximum quality
+ASR_BEAM_SIZE = int(os.getenv("ASR_BEAM_SIZE", "1"))
+# Temperatures retried in order when a window fails the compression/log-prob checks
+ASR_TEMPERATURE_FALLBACK = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+# Batch 30 s windows of long audio through faster_whisper's BatchedInferencePipeline
+# (uses VAD, so segment boundaries differ slightly from sequential decoding)
+ASR_BATCHED = os.getenv("ASR_BATCHED", "0") == "1"
+ASR_BATCH_SIZE = int(os.getenv("ASR_BATCH_SIZE", "8"))
+# torch.compile the openai-whisper encoder on GPU
+ASR_COMPILE = os.getenv("ASR_COMPILE", "0") == "1"
+
+# Whisper expects 16 kHz mono audio
+SAMPLE_RATE = 16000
+
+# Micro-batching of concurrent openai-whisper requests (clips up to 30 s)
+ASR_BATCHER = os.getenv("ASR_BATCHER", "0") == "1"
+ASR_MAX_BATCH = int(os.getenv("ASR_MAX_BATCH", "8"))
+ASR_MAX_WAIT_MS = int(os.getenv("ASR_MAX_WAIT_MS", "20"))
+# Quality checks applied per batched window, same defaults as whisper.transcribe()
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
 
 # Global model instance
 model = None
+# faster_whisper batched pipeline wrapping the model (ASR_BATCHED=1)
+batched_pipeline = None
+
+# Buffers reused by the openai-whisper language detection path on GPU
+audio_pinned = None
+mel_gpu = None
+
+# openai-whisper batching queue, or the faster_whisper concurrency limit
+batch_queue = None
+batcher_task = None
+transcribe_semaphore = None
+
+# openai-whisper keeps its kv cache in hooks on the shared decoder modules, so
+# every call into that model runs on this single thread
+openai_whisper_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="openai-whisper")
+
+
+def _torch():
+    """Import torch on first use and bind it to the module-level name."""
+    global torch
+    if torch is None:
+        import torch as _t
+        _t.set_num_threads(int(os.environ["OMP_NUM_THREADS"]))
+        _t.set_num_interop_threads(1)
+        torch = _t
+    return torch
+
+
+@functools.lru_cache(maxsize=None)
+def cuda_available() -> bool:
+    """Return whether the configured engine can use a CUDA device."""
+    if ASR_ENGINE == "faster_whisper":
+        import ctranslate2
+        return ctranslate2.get_cuda_device_count() > 0
+    return _torch().cuda.is_available()
+
 
 app = FastAPI(
     title="Whisper ASR API",
@@ -32,36 +119,328 @@ app = FastAPI(
 
 def get_model():
     """Load and cache the Whisper model."""
-    global model
+    global model, batched_pipeline
     if model is None:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
+        device = "cuda" if cuda_available() else "cpu"
         logger.info(f"Loading Whisper model '{ASR_MODEL}' on device '{device}'...")
 
         if ASR_ENGINE == "faster_whisper":
             from faster_whisper import WhisperModel
-            compute_type = "float16" if device == "cuda" else "int8"
-            model = WhisperModel(
-                ASR_MODEL,
-                device=device,
-                compute_type=compute_type,
-                download_root=ASR_MODEL_PATH
-            )
+            from prepare_model import converted_model_dir
+
+            # Prefer the checkpoint pre-quantized at build time over downloading the original
+            model_source = converted_model_dir(ASR_MODEL)
+            if os.path.isdir(model_source):
+                logger.info(f"Using pre-converted model at {model_source}")
+            else:
+                model_source = ASR_MODEL
+
+            # Fall back to widely supported types if the device rejects the requested one
+            compute_types = [ASR_QUANTIZATION] + [t for t in ("float16", "int8") if t != ASR_QUANTIZATION]
+            for compute_type in compute_types:
+                try:
+                    model = WhisperModel(
+                        model_source,
+                        device=device,
+                        compute_type=compute_type,
+                        download_root=ASR_MODEL_PATH,
+                        num_workers=ASR_NUM_WORKERS,
+                        cpu_threads=ASR_CPU_THREADS
+                    )
+                    break
+                except ValueError as e:
+                    logger.warning(f"Compute type '{compute_type}' not supported on '{device}': {e}")
+            else:
+                raise RuntimeError(f"No supported compute type found among {compute_types}")
+            logger.info(f"Using compute type '{compute_type}'")
+
+            if ASR_BATCHED:
+                from faster_whisper import BatchedInferencePipeline
+                batched_pipeline = BatchedInferencePipeline(model=model)
+                logger.info(f"Batched inference enabled (batch size {ASR_BATCH_SIZE})")
         else:
             import whisper
+            _torch()  # binds the module-level torch used by the openai-whisper helpers
             model = whisper.load_model(ASR_MODEL, device=device, download_root=ASR_MODEL_PATH)
+            if device == "cuda":
+                # Store FP16 weights so whisper's layers stop casting FP32 weights per call
+                model = model.half()
+            if ASR_COMPILE and device == "cuda":
+                # Only the fixed-shape encoder: the decoder's growing token length and
+                # per-call kv-cache hooks defeat both Dynamo guards and CUDA graph replay
+                logger.info("Compiling encoder with torch.compile...")
+                model.encoder = torch.compile(model.encoder, mode="reduce-overhead", fullgraph=True)
 
         logger.info(f"Model loaded successfully using {ASR_ENGINE} engine")
     return model
 
 
+def decode_audio(file: BinaryIO) -> np.ndarray:
+    """Decode an uploaded audio file into a 16 kHz mono float32 array."""
+    file.seek(0)
+    try:
+        audio, sr = sf.read(file, dtype="float32", always_2d=False)
+    except RuntimeError:
+        # Formats libsndfile cannot read (m4a, webm, ...) go through PyAV
+        from faster_whisper.audio import decode_audio as av_decode_audio
+        file.seek(0)
+        return av_decode_audio(file, sampling_rate=SAMPLE_RATE)
+
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    if sr != SAMPLE_RATE:
+        from scipy.signal import resample_poly
+        gcd = math.gcd(sr, SAMPLE_RATE)
+        audio = resample_poly(audio, SAMPLE_RATE // gcd, sr // gcd)
+    return np.ascontiguousarray(audio, dtype=np.float32)
+
+
+def model_dtype(whisper_model):
+    """Return the parameter dtype of an openai-whisper model (FP16 on CUDA)."""
+    return next(whisper_model.parameters()).dtype
+
+
+def allocate_mel_buffers(whisper_model):
+    """Pre-allocate the pinned audio and GPU mel buffers for language detection."""
+    global audio_pinned, mel_gpu
+    import whisper
+    audio_pinned = torch.empty(whisper.audio.N_SAMPLES, dtype=torch.float32, pin_memory=True)
+    mel_gpu = torch.empty(
+        whisper_model.dims.n_mels, whisper.audio.N_FRAMES, dtype=model_dtype(whisper_model), device=whisper_model.device
+    )
+
+
+@contextlib.contextmanager
+def inference_context():
+    """Disable autograd and run eligible ops under FP16 autocast on GPU."""
+    with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16, enabled=cuda_available()):
+        yield
+
+
+def log_mel_spectrogram(whisper_model, audio: np.ndarray):
+    """Compute the padded log-Mel spectrogram of a 30 s window on the model device."""
+    import whisper
+    if mel_gpu is None:
+        audio = whisper.pad_or_trim(torch.from_numpy(audio))
+        return whisper.log_mel_spectrogram(audio, n_mels=whisper_model.dims.n_mels).to(whisper_model.device)
+
+    n = min(len(audio), whisper.audio.N_SAMPLES)
+    audio_pinned[:n].copy_(torch.from_numpy(audio[:n]))
+    audio_pinned[n:].zero_()
+    audio_gpu = audio_pinned.to(whisper_model.device, non_blocking=True)
+    mel_gpu.copy_(whisper.log_mel_spectrogram(audio_gpu, n_mels=whisper_model.dims.n_mels))
+    return mel_gpu
+
+
+def warmup_model(whisper_model):
+    """Encode a silent 30 s mel so compilation happens before the first request."""
+    import whisper
+    mel = torch.zeros(
+        1, whisper_model.dims.n_mels, whisper.audio.N_FRAMES, dtype=model_dtype(whisper_model), device=whisper_model.device
+    )
+    with inference_context():
+        whisper_model.embed_audio(mel)
+    logger.info("Model warm-up completed")
+
+
+async def run_openai_whisper(func, *args):
+    """Run an openai-whisper model call on the dedicated inference thread."""
+    return await asyncio.get_running_loop().run_in_executor(openai_whisper_executor, functools.partial(func, *args))
+
+
+def transcribe_openai_whisper(whisper_model, audio: np.ndarray, task: str, language: Optional[str]):
+    """Transcribe with openai-whisper and return its result dict."""
+    with inference_context():
+        return whisper_model.transcribe(
+            audio,
+            task=task,
+            language=language,
+            beam_size=ASR_BEAM_SIZE if ASR_BEAM_SIZE > 1 else None,
+            temperature=ASR_TEMPERATURE_FALLBACK,
+            condition_on_previous_text=False
+        )
+
+
+def detect_language_openai_whisper(whisper_model, audio: np.ndarray):
+    """Return openai-whisper's language probabilities for the first 30 s of audio."""
+    mel = log_mel_spectrogram(whisper_model, audio)
+    with inference_context():
+        _, probs = whisper_model.detect_language(mel)
+    return probs
+
+
+def is_silent(result) -> bool:
+    """Return whether whisper.transcribe() would treat a decoded window as silence."""
+    return result.no_speech_prob > NO_SPEECH_THRESHOLD and not result.avg_logprob > LOGPROB_THRESHOLD
+
+
+def decode_batch(mels, task, language):
+    """Run the encoder once over a stack of mels and decode every item.
+
+    Mirrors whisper.transcribe() for a single window: items failing the compression
+    or log-prob checks are retried at the next fallback temperature, and windows
+    judged as silence return empty text.
+    """
+    import whisper
+    whisper_model = get_model()
+    mel_batch = torch.stack(mels)
+    results = [None] * len(mels)
+    pending = list(range(len(mels)))
+
+    with inference_context():
+        for temperature in ASR_TEMPERATURE_FALLBACK:
+            options = whisper.DecodingOptions(
+                task=task,
+                language=language,
+                temperature=temperature,
+                beam_size=ASR_BEAM_SIZE if temperature == 0 and ASR_BEAM_SIZE > 1 else None,
+                best_of=5 if temperature > 0 else None,
+                fp16=whisper_model.device.type == "cuda"
+            )
+            retry = []
+            for i, result in zip(pending, whisper.decode(whisper_model, mel_batch[pending], options)):
+                results[i] = result
+                failed = (
+                    result.compression_ratio > COMPRESSION_RATIO_THRESHOLD
+                    or result.avg_logprob < LOGPROB_THRESHOLD
+                )
+                if failed and not is_silent(result):
+                    retry.append(i)
+            pending = retry
+            if not pending:
+                break
+
+    return [dataclasses.replace(result, text="") if is_silent(result) else result for result in results]
+
+
+async def batcher_loop():
+    """Collect queued requests for up to ASR_MAX_WAIT_MS and decode them together."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await batch_queue.get()]
+        deadline = loop.time() + ASR_MAX_WAIT_MS / 1000
+        while len(batch) < ASR_MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(batch_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Decoding options are shared across a batch, so group by task and language
+        groups = {}
+        for mel, task, language, future in batch:
+            groups.setdefault((task, language), []).append((mel, future))
+
+        for (task, language), items in groups.items():
+            try:
+                results = await run_openai_whisper(decode_batch, [mel for mel, _ in items], task, language)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(items, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+def batch_mel_spectrogram(whisper_model, audio: np.ndarray):
+    """Compute a padded 30 s mel on the model device for the batcher."""
+    import whisper
+    audio = whisper.pad_or_trim(torch.from_numpy(audio))
+    return whisper.log_mel_spectrogram(audio, n_mels=whisper_model.dims.n_mels, device=whisper_model.device)
+
+
+async def submit_to_batcher(whisper_model, audio: np.ndarray, task: str, language: Optional[str]):
+    """Queue a clip of at most 30 s for batched decoding and wait for its result."""
+    mel = await run_openai_whisper(batch_mel_spectrogram, whisper_model, audio)
+    future = asyncio.get_running_loop().create_future()
+    await batch_queue.put((mel, task, language, future))
+    return await future
+
+
+def start_faster_whisper(whisper_model, audio: np.ndarray, task: str, language: Optional[str]):
+    """Start a faster_whisper transcription; segments are decoded lazily as they are iterated."""
+    if batched_pipeline is not None:
+        return batched_pipeline.transcribe(
+            audio,
+            task=task,
+            language=language,
+            beam_size=ASR_BEAM_SIZE,
+            temperature=ASR_TEMPERATURE_FALLBACK,
+            condition_on_previous_text=False,
+            batch_size=ASR_BATCH_SIZE
+        )
+    return whisper_model.transcribe(
+        audio,
+        task=task,
+        language=language,
+        beam_size=ASR_BEAM_SIZE,
+        temperature=ASR_TEMPERATURE_FALLBACK,
+        condition_on_previous_text=False
+    )
+
+
+def run_faster_whisper(whisper_model, audio: np.ndarray, task: str, language: Optional[str]):
+    """Transcribe with faster_whisper and return the joined text and detected language."""
+    segments, info = start_faster_whisper(whisper_model, audio, task, language)
+    text = " ".join([segment.text for segment in segments])
+    return text, info.language
+
+
+def segment_line(start: float, end: float, text: str) -> bytes:
+    """Format one transcribed segment as an NDJSON line."""
+    return orjson.dumps({"start": start, "end": end, "text": text}) + b"\n"
+
+
+def release_once(semaphore: asyncio.Semaphore):
+    """Return a callable that releases the semaphore on its first call only."""
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            semaphore.release()
+    return release
+
+
+async def stream_segments(segments, release):
+    """Yield NDJSON segment lines as soon as faster_whisper decodes them, then release the slot."""
+    try:
+        segments = iter(segments)
+        while (segment := await run_in_threadpool(next, segments, None)) is not None:
+            yield segment_line(segment.start, segment.end, segment.text)
+    finally:
+        release()
+
+
 @app.on_event("startup")
 async def startup_event():
     """Preload model on startup."""
     logger.info("Starting Whisper ASR Server...")
-    logger.info(f"CUDA available: {torch.cuda.is_available()}")
-    if torch.cuda.is_available():
-        logger.info(f"CUDA device: {torch.cuda.get_device_name(0)}")
-    get_model()
+    logger.info(f"CUDA available: {cuda_available()}")
+    if cuda_available() and ASR_ENGINE != "faster_whisper":
+        logger.info(f"CUDA device: {_torch().cuda.get_device_name(0)}")
+    global batch_queue, batcher_task, transcribe_semaphore
+    whisper_model = get_model()
+    if ASR_ENGINE == "faster_whisper":
+        # CTranslate2 batches internally; just cap concurrent transcriptions
+        transcribe_semaphore = asyncio.Semaphore(ASR_NUM_WORKERS)
+    else:
+        if cuda_available():
+            # Mel input shape is fixed at (n_mels, 3000), so cuDNN autotuning pays off once
+            torch.backends.cudnn.benchmark = True
+            allocate_mel_buffers(whisper_model)
+            if ASR_COMPILE:
+                # CUDA graphs are recorded per thread, so warm up on the inference thread
+                await run_openai_whisper(warmup_model, whisper_model)
+        if ASR_BATCHER:
+            batch_queue = asyncio.Queue()
+            batcher_task = asyncio.create_task(batcher_loop())
+            logger.info(f"Batching enabled (max batch {ASR_MAX_BATCH}, max wait {ASR_MAX_WAIT_MS} ms)")
 
 
 @app.get("/")
@@ -71,7 +450,7 @@ async def root():
         "status": "healthy",
         "model": ASR_MODEL,
         "engine": ASR_ENGINE,
-        "cuda_available": torch.cuda.is_available()
+        "cuda_available": cuda_available()
     }
 
 
@@ -91,35 +470,45 @@ async def transcribe(
         audio_file: Audio file to transcribe
         task: 'transcribe' or 'translate'
         language: Language code (e.g., 'en', 'ko'). Auto-detect if not specified.
-        output: Output format ('json', 'txt', 'vtt', 'srt')
+        output: Output format ('json', 'txt', 'vtt', 'srt', or 'ndjson' to stream segments)
     """
     if audio_file is None:
         raise HTTPException(status_code=400, detail="No audio file provided")
 
-    # Save uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(audio_file.filename)[1]) as tmp:
-        content = await audio_file.read()
-        tmp.write(content)
-        tmp_path = tmp.name
-
     try:
+        audio = await run_in_threadpool(decode_audio, audio_file.file)
         whisper_model = get_model()
 
-        if ASR_ENGINE == "faster_whisper":
-            segments, info = whisper_model.transcribe(
-                tmp_path,
-                task=task,
-                language=language,
-                beam_size=5
+        if ASR_ENGINE == "faster_whisper" and output == "ndjson":
+            # Start the transcription here so setup errors (e.g. an invalid language)
+            # still map to a 500; only the segment iteration is streamed
+            await transcribe_semaphore.acquire()
+            release = release_once(transcribe_semaphore)
+            try:
+                segments, _ = await run_in_threadpool(start_faster_whisper, whisper_model, audio, task, language)
+            except Exception:
+                release()
+                raise
+            # The background task covers clients that disconnect before the stream starts
+            return StreamingResponse(
+                stream_segments(segments, release),
+                media_type="application/x-ndjson",
+                background=BackgroundTask(release)
             )
-            text = " ".join([segment.text for segment in segments])
-            detected_language = info.language
+        elif ASR_ENGINE == "faster_whisper":
+            async with transcribe_semaphore:
+                text, detected_language = await run_in_threadpool(
+                    run_faster_whisper, whisper_model, audio, task, language
+                )
+        elif batch_queue is not None and output != "ndjson" and len(audio) <= 30 * SAMPLE_RATE:
+            result = await submit_to_batcher(whisper_model, audio, task, language)
+            text = result.text
+            detected_language = result.language
         else:
-            result = whisper_model.transcribe(
-                tmp_path,
-                task=task,
-                language=language
-            )
+            result = await run_openai_whisper(transcribe_openai_whisper, whisper_model, audio, task, language)
+            if output == "ndjson":
+                lines = [segment_line(seg["start"], seg["end"], seg["text"]) for seg in result["segments"]]
+                return StreamingResponse(iter(lines), media_type="application/x-ndjson")
             text = result["text"]
             detected_language = result.get("language", language)
 
@@ -136,32 +525,21 @@ async def transcribe(
         logger.error(f"Transcription error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-    finally:
-        # Clean up temporary file
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
-
 
 @app.post("/detect-language")
 async def detect_language(audio_file: UploadFile = File(...)):
     """Detect the language of an audio file."""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(audio_file.filename)[1]) as tmp:
-        content = await audio_file.read()
-        tmp.write(content)
-        tmp_path = tmp.name
-
     try:
+        audio = await run_in_threadpool(decode_audio, audio_file.file)
         whisper_model = get_model()
 
         if ASR_ENGINE == "faster_whisper":
-            _, info = whisper_model.transcribe(tmp_path)
-            return {"detected_language": info.language, "language_probability": info.language_probability}
+            # Encoder plus a single language-token step; skips the full decoder pass
+            async with transcribe_semaphore:
+                detected_lang, probability, _ = await run_in_threadpool(whisper_model.detect_language, audio)
+            return {"detected_language": detected_lang, "language_probability": probability}
         else:
-            import whisper
-            audio = whisper.load_audio(tmp_path)
-            audio = whisper.pad_or_trim(audio)
-            mel = whisper.log_mel_spectrogram(audio).to(whisper_model.device)
-            _, probs = whisper_model.detect_language(mel)
+            probs = await run_openai_whisper(detect_language_openai_whisper, whisper_model, audio)
             detected_lang = max(probs, key=probs.get)
             return {"detected_language": detected_lang, "language_probability": probs[detected_lang]}
 
@@ -169,11 +547,15 @@ async def detect_language(audio_file: UploadFile = File(...)):
         logger.error(f"Language detection error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-    finally:
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
-
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=9000)
+    # An import string lets uvicorn spawn workers; each runs startup_event and loads its own model
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=9000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("ASR_WORKERS", "1"))
+    )
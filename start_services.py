@@ -11,14 +11,52 @@ import subprocess
 import shutil
 import time
 import argparse
-import platform
+import json
+import secrets
 import sys
+from pathlib import Path
+
+# Setup steps that already ran are skipped while this cache is fresh
+BOOTSTRAP_CACHE_PATH = Path.home() / ".cache" / "localai" / "bootstrap.json"
+BOOTSTRAP_CACHE_TTL = 24 * 60 * 60
+BOOTSTRAP_WATCHED_FILES = ["docker-compose.yml", os.path.join("searxng", "settings.yml")]
 
 def run_command(cmd, cwd=None):
     """Run a shell command and print it."""
     print("Running:", " ".join(cmd))
     subprocess.run(cmd, cwd=cwd, check=True)
 
+def watched_file_mtimes():
+    """Return the modification times of the files the bootstrap cache depends on."""
+    return {path: os.path.getmtime(path) if os.path.exists(path) else None for path in BOOTSTRAP_WATCHED_FILES}
+
+def run_cached(step, func):
+    """Run a setup step unless it succeeded in the last 24h and no watched file changed since.
+
+    The step is only recorded when func() returns True, so failures are retried next run.
+    """
+    try:
+        cache = json.loads(BOOTSTRAP_CACHE_PATH.read_text())
+    except (OSError, ValueError):
+        cache = {}
+
+    # Keyed by project directory so several checkouts can share the cache file
+    project_cache = cache.setdefault(os.getcwd(), {})
+    entry = project_cache.get(step)
+    if entry and time.time() - entry["timestamp"] < BOOTSTRAP_CACHE_TTL and entry["mtimes"] == watched_file_mtimes():
+        print(f"Skipping {step}: nothing changed since last run (cache: {BOOTSTRAP_CACHE_PATH})")
+        return
+
+    if not func():
+        return
+
+    project_cache[step] = {"timestamp": time.time(), "mtimes": watched_file_mtimes()}
+    try:
+        BOOTSTRAP_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        BOOTSTRAP_CACHE_PATH.write_text(json.dumps(cache, indent=2))
+    except OSError as e:
+        print(f"Note: Could not write bootstrap cache: {e}")
+
 def clone_supabase_repo():
     """Clone the Supabase repository using sparse checkout if not already present."""
     if not os.path.exists("supabase"):
@@ -27,16 +65,17 @@ def clone_supabase_repo():
             "git", "clone", "--filter=blob:none", "--no-checkout",
             "https://github.com/supabase/supabase.git"
         ])
-        os.chdir("supabase")
-        run_command(["git", "sparse-checkout", "init", "--cone"])
-        run_command(["git", "sparse-checkout", "set", "docker"])
-        run_command(["git", "checkout", "master"])
-        os.chdir("..")
+        run_command(["git", "-C", "supabase", "sparse-checkout", "init", "--cone"])
+        run_command(["git", "-C", "supabase", "sparse-checkout", "set", "docker"])
+        run_command(["git", "-C", "supabase", "checkout", "master"])
     else:
         print("Supabase repository already exists, updating...")
-        os.chdir("supabase")
-        run_command(["git", "pull"])
-        os.chdir("..")
+        run_cached("supabase_pull", pull_supabase_repo)
+
+def pull_supabase_repo():
+    """Update the existing Supabase checkout; raises if git pull fails."""
+    run_command(["git", "-C", "supabase", "pull"])
+    return True
 
 def prepare_supabase_env():
     """Copy .env to .env in supabase/docker."""
@@ -49,28 +88,13 @@ def stop_existing_containers(profile=None, environment=None):
     """Stop and remove all containers for the unified project 'localai'."""
     print("Stopping and removing existing containers for the unified project 'localai'...")
 
-    # [수정] 모든 프로필의 컨테이너를 제거하기 위해 여러 번 down 실행
-    # 이렇게 하면 이전에 다른 프로필로 실행된 컨테이너도 제거됩니다
+    # [수정] 모든 프로필을 한 번의 down으로 제거
+    # 이전에 다른 프로필로 실행된 컨테이너와 프로필이 없는 서비스도 함께 제거됩니다
     profiles_to_clean = ["cpu", "gpu-nvidia", "gpu-amd"]
 
-    for prof in profiles_to_clean:
-        cmd = ["docker", "compose", "-p", "localai", "--profile", prof]
-        cmd.extend(["-f", "docker-compose.yml"])
-        if environment and environment == "private":
-            cmd.extend(["-f", "docker-compose.override.private.yml"])
-        if environment and environment == "public":
-            cmd.extend(["-f", "docker-compose.override.public.yml"])
-            cmd.extend(["-f", "docker-compose.override.public.supabase.yml"])
-        cmd.extend(["down"])
-
-        # 에러가 발생해도 계속 진행 (해당 프로필의 컨테이너가 없을 수 있음)
-        try:
-            run_command(cmd)
-        except subprocess.CalledProcessError:
-            print(f"Note: No containers found for profile '{prof}' or already removed")
-
-    # 프로필이 지정되지 않은 서비스들도 제거
     cmd = ["docker", "compose", "-p", "localai"]
+    for prof in profiles_to_clean:
+        cmd.extend(["--profile", prof])
     cmd.extend(["-f", "docker-compose.yml"])
     if environment and environment == "private":
         cmd.extend(["-f", "docker-compose.override.private.yml"])
@@ -79,10 +103,11 @@ def stop_existing_containers(profile=None, environment=None):
         cmd.extend(["-f", "docker-compose.override.public.supabase.yml"])
     cmd.extend(["down"])
 
+    # 에러가 발생해도 계속 진행
     try:
         run_command(cmd)
-    except subprocess.CalledProcessError:
-        print("Note: No containers found without profile or already removed")
+    except subprocess.CalledProcessError as e:
+        print(f"Warning: 'docker compose down' failed (exit code {e.returncode})")
 
 # [수정] 'start_local_ai' 함수를 'start_services'로 변경하고 모든 파일을 포함
 def start_services(profile=None, environment=None):
@@ -124,7 +149,10 @@ def start_services(profile=None, environment=None):
             print(f"Note: Could not auto-start n8n: {start_error}")
 
 def generate_searxng_secret_key():
-    """Generate a secret key for SearXNG based on the current platform."""
+    """Generate a secret key for SearXNG if the placeholder is still present.
+
+    Returns True once a key is configured, False if setup failed.
+    """
     print("Checking SearXNG settings...")
 
     # Define paths for SearXNG settings files
@@ -134,7 +162,7 @@ def generate_searxng_secret_key():
     # Check if settings-base.yml exists
     if not os.path.exists(settings_base_path):
         print(f"Warning: SearXNG base settings file not found at {settings_base_path}")
-        return
+        return False
 
     # Check if settings.yml exists, if not create it from settings-base.yml
     if not os.path.exists(settings_path):
@@ -144,66 +172,32 @@ def generate_searxng_secret_key():
             print(f"Created {settings_path} from {settings_base_path}")
         except Exception as e:
             print(f"Error creating settings.yml: {e}")
-            return
+            return False
     else:
         print(f"SearXNG settings.yml already exists at {settings_path}")
 
     # Check if secret key is already set (not 'ultrasecretkey')
     try:
-        with open(settings_path, 'r') as f:
-            content = f.read()
-            if 'ultrasecretkey' not in content:
-                print("SearXNG secret key already configured. Skipping generation.")
-                return
+        content = Path(settings_path).read_text()
     except Exception as e:
         print(f"Error reading settings file: {e}")
+        return False
 
-    print("Generating SearXNG secret key...")
+    if 'ultrasecretkey' not in content:
+        print("SearXNG secret key already configured. Skipping generation.")
+        return True
 
-    # Detect the platform and run the appropriate command
-    system = platform.system()
+    print("Generating SearXNG secret key...")
 
     try:
-        if system == "Windows":
-            print("Detected Windows platform, using PowerShell to generate secret key...")
-            # PowerShell command to generate a random key and replace in the settings file
-            ps_command = [
-                "powershell", "-Command",
-                "$randomBytes = New-Object byte[] 32; " +
-                "(New-Object Security.Cryptography.RNGCryptoServiceProvider).GetBytes($randomBytes); " +
-                "$secretKey = -join ($randomBytes | ForEach-Object { \"{0:x2}\" -f $_ }); " +
-                "(Get-Content searxng/settings.yml) -replace 'ultrasecretkey', $secretKey | Set-Content searxng/settings.yml"
-            ]
-            subprocess.run(ps_command, check=True)
-
-        elif system == "Darwin":  # macOS
-            print("Detected macOS platform, using sed command with empty string parameter...")
-            # macOS sed command requires an empty string for the -i parameter
-            openssl_cmd = ["openssl", "rand", "-hex", "32"]
-            random_key = subprocess.check_output(openssl_cmd).decode('utf-8').strip()
-            sed_cmd = ["sed", "-i", "", f"s|ultrasecretkey|{random_key}|g", settings_path]
-            subprocess.run(sed_cmd, check=True)
-
-        else:  # Linux and other Unix-like systems
-            print("Detected Linux/Unix platform, using standard sed command...")
-            # Standard sed command for Linux
-            openssl_cmd = ["openssl", "rand", "-hex", "32"]
-            random_key = subprocess.check_output(openssl_cmd).decode('utf-8').strip()
-            sed_cmd = ["sed", "-i", f"s|ultrasecretkey|{random_key}|g", settings_path]
-            subprocess.run(sed_cmd, check=True)
-
+        Path(settings_path).write_text(content.replace('ultrasecretkey', secrets.token_hex(32)))
         print("SearXNG secret key generated successfully.")
-
+        return True
     except Exception as e:
         print(f"Error generating SearXNG secret key: {e}")
-        print("You may need to manually generate the secret key using the commands:")
-        print("  - Linux: sed -i \"s|ultrasecretkey|$(openssl rand -hex 32)|g\" searxng/settings.yml")
-        print("  - macOS: sed -i '' \"s|ultrasecretkey|$(openssl rand -hex 32)|g\" searxng/settings.yml")
-        print("  - Windows (PowerShell):")
-        print("    $randomBytes = New-Object byte[] 32")
-        print("    (New-Object Security.Cryptography.RNGCryptoServiceProvider).GetBytes($randomBytes)")
-        print("    $secretKey = -join ($randomBytes | ForEach-Object { \"{0:x2}\" -f $_ })")
-        print("    (Get-Content searxng/settings.yml) -replace 'ultrasecretkey', $secretKey | Set-Content searxng/settings.yml")
+        print("You may need to manually replace 'ultrasecretkey' in searxng/settings.yml with a random hex string,")
+        print("e.g. the output of: python -c \"import secrets; print(secrets.token_hex(32))\"")
+        return False
 
 def check_and_fix_docker_compose_for_searxng():
     """Check and modify docker-compose.yml for SearXNG first run."""
@@ -212,6 +206,12 @@ def check_and_fix_docker_compose_for_searxng():
         print(f"Warning: Docker Compose file not found at {docker_compose_path}")
         return
 
+    # Once SearXNG has been initialized there is nothing left to check
+    initialized_marker_path = os.path.join("searxng", ".initialized")
+    if os.path.exists(initialized_marker_path):
+        print("SearXNG already initialized. Skipping first-run check.")
+        return
+
     try:
         # Read the docker-compose.yml file
         with open(docker_compose_path, 'r') as file:
@@ -220,34 +220,19 @@ def check_and_fix_docker_compose_for_searxng():
         # Default to first run
         is_first_run = True
 
-        # Check if Docker is running and if the SearXNG container exists
+        # A SearXNG container that has started before has already generated uwsgi.ini
         try:
-            # Check if the SearXNG container is running
             container_check = subprocess.run(
-                ["docker", "ps", "--filter", "name=searxng", "--format", "{{.Names}}"],
-                capture_output=True, text=True, check=True
+                ["docker", "inspect", "--format", "{{.State.StartedAt}}", "searxng"],
+                capture_output=True, text=True, check=False
             )
-            searxng_containers = container_check.stdout.strip().split('\n')
-
-            # If SearXNG container is running, check inside for uwsgi.ini
-            if any(container for container in searxng_containers if container):
-                container_name = next(container for container in searxng_containers if container)
-                print(f"Found running SearXNG container: {container_name}")
-
-                # Check if uwsgi.ini exists inside the container
-                container_check = subprocess.run(
-                    ["docker", "exec", container_name, "sh", "-c", "[ -f /etc/searxng/uwsgi.ini ] && echo 'found' || echo 'not_found'"],
-                    capture_output=True, text=True, check=False
-                )
-
-                if "found" in container_check.stdout:
-                    print("Found uwsgi.ini inside the SearXNG container - not first run")
-                    is_first_run = False
-                else:
-                    print("uwsgi.ini not found inside the SearXNG container - first run")
-                    is_first_run = True
+            started_at = container_check.stdout.strip()
+
+            if container_check.returncode == 0 and started_at and not started_at.startswith("0001-01-01"):
+                print(f"SearXNG container last started at {started_at} - not first run")
+                is_first_run = False
             else:
-                print("No running SearXNG container found - assuming first run")
+                print("No started SearXNG container found - assuming first run")
         except Exception as e:
             print(f"Error checking Docker container: {e} - assuming first run")
 
@@ -270,6 +255,9 @@ def check_and_fix_docker_compose_for_searxng():
             with open(docker_compose_path, 'w') as file:
                 file.write(modified_content)
 
+        if not is_first_run:
+            Path(initialized_marker_path).touch()
+
     except Exception as e:
         print(f"Error checking/modifying docker-compose.yml for SearXNG: {e}")
 
@@ -285,7 +273,8 @@ def main():
     prepare_supabase_env()
 
     # Generate SearXNG secret key and check docker-compose.yml
-    generate_searxng_secret_key()
+    run_cached("searxng_secret_key", generate_searxng_secret_key)
+    # Not cached: it depends on SearXNG container state, and the .initialized marker already makes it cheap
     check_and_fix_docker_compose_for_searxng()
 
     # [수정] 'stop' 함수에도 environment 전달